@@ -0,0 +1,50 @@
+"""
+Cache Helper Functions
+
+Redis helper functions used to keep hot lookups off MongoDB.
+Caching is optional: when REDIS_URL is not set no client is created, and callers
+treat Redis errors (timeouts, outages) as cache misses and fall back to the database.
+"""
+
+import os
+from dotenv import load_dotenv
+import redis.asyncio as redis
+
+# Load environment variables from .env file
+load_dotenv()
+
+cache = None
+
+redis_url = os.getenv("REDIS_URL")
+# Seconds to wait on Redis before treating it as unavailable (redis-py waits forever by default)
+redis_timeout = float(os.getenv("REDIS_TIMEOUT", "0.25"))
+
+# Set of conversation ids known to exist
+CONVERSATION_EXISTS_KEY = "conv:exists"
+# Short-lived negative cache so unknown ids don't hit the database repeatedly
+CONVERSATION_MISSING_TTL = 60
+# Cached message history payloads, keyed by conversation version
+MESSAGES_TTL = 300
+# Larger histories are streamed without being cached, keeping memory bounded
+MESSAGES_CACHE_MAX_BYTES = 1 << 20
+
+
+def connect_cache():
+    """Create the async Redis client; returns None when REDIS_URL is not configured"""
+    global cache
+    if cache is None and redis_url:
+        cache = redis.Redis.from_url(
+            redis_url,
+            socket_connect_timeout=redis_timeout,
+            socket_timeout=redis_timeout,
+        )
+    return cache
+
+def conversation_missing_key(conversation_id: str) -> str:
+    return f"conv:missing:{conversation_id}"
+
+def messages_version_key(conversation_id: str) -> str:
+    return f"conv:ver:{conversation_id}"
+
+def messages_key(conversation_id: str, version: str) -> str:
+    return f"msgs:{conversation_id}:{version}"
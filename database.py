@@ -6,6 +6,7 @@ Import and use these functions in your API endpoints for database operations.
 """
 
 from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
@@ -18,19 +19,30 @@ load_dotenv()
 _client = None
 db = None
 
+_async_client = None
+async_db = None
+
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
+# Connection pool settings for the async client used by the API. Kept small per
+# process since the server runs several workers; the sync client below keeps
+# driver defaults (no idle connections) for scripts
+async_client_options = {
+    "maxPoolSize": 50,
+    "minPoolSize": 2,
+    "waitQueueTimeoutMS": 2000,
+    "serverSelectionTimeoutMS": 2000,
+}
+
 if database_url and database_name:
     _client = MongoClient(database_url)
     db = _client[database_name]
 
-# Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
-    """Insert a single document with timestamp"""
-    if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+_UNAVAILABLE = "Database not available. Check DATABASE_URL and DATABASE_NAME environment variables."
 
+def _prepare_document(data: Union[BaseModel, dict]) -> dict:
+    """Copy data into a plain dict stamped with created_at/updated_at"""
     # Convert Pydantic model to dict if needed
     if isinstance(data, BaseModel):
         data_dict = data.model_dump()
@@ -39,17 +51,42 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
 
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
+    return data_dict
 
+# Helper functions for common database operations
+def create_document(collection_name: str, data: Union[BaseModel, dict]):
+    """Insert a single document with timestamp"""
+    if db is None:
+        raise Exception(_UNAVAILABLE)
+
+    data_dict = _prepare_document(data)
     result = db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
 def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+        raise Exception(_UNAVAILABLE)
     
     cursor = db[collection_name].find(filter_dict or {})
     if limit:
         cursor = cursor.limit(limit)
     
     return list(cursor)
+
+def connect_async_db():
+    """Create the async (Motor) database handle; call from within the running event loop"""
+    global _async_client, async_db
+    if async_db is None and database_url and database_name:
+        _async_client = AsyncIOMotorClient(database_url, **async_client_options)
+        async_db = _async_client[database_name]
+    return async_db
+
+async def create_document_async(collection_name: str, data: Union[BaseModel, dict]):
+    """Insert a single document with timestamp using the async client"""
+    if async_db is None:
+        raise Exception(_UNAVAILABLE)
+
+    data_dict = _prepare_document(data)
+    result = await async_db[collection_name].insert_one(data_dict)
+    return str(result.inserted_id)
@@ -1,23 +1,85 @@
+import heapq
+import logging
 import os
-from typing import List, Optional, Any, Dict
-from fastapi import FastAPI, HTTPException
+import re
+import time
+from functools import lru_cache
+from datetime import datetime, timezone
+from typing import List, Optional, Any, Dict, Literal
+import orjson
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import PyMongoError
+from redis.exceptions import RedisError
+
+from database import connect_async_db, create_document_async
+from cache import (
+    connect_cache,
+    CONVERSATION_EXISTS_KEY,
+    CONVERSATION_MISSING_TTL,
+    MESSAGES_CACHE_MAX_BYTES,
+    MESSAGES_TTL,
+    conversation_missing_key,
+    messages_key,
+    messages_version_key,
+)
+
+app = FastAPI(default_response_class=ORJSONResponse)
+logger = logging.getLogger(__name__)
+
+
+class OriginAwareCORSMiddleware(CORSMiddleware):
+    """CORSMiddleware that passes requests without an Origin header straight through"""
 
-from database import db, create_document, get_documents
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not any(name == b"origin" for name, _ in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
 
-app = FastAPI()
+
+# Comma-separated allowlist; credentials are only allowed with explicit origins,
+# since a wildcard origin with credentials is invalid per the CORS spec
+cors_origins = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()]
 
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    OriginAwareCORSMiddleware,
+    allow_origins=cors_origins or ["*"],
+    allow_credentials=bool(cors_origins),
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=86400,
 )
 
 
+# Async (Motor) database handle, created once the event loop is running
+db = None
+# Optional Redis client (None when REDIS_URL is not set)
+cache = None
+
+
+@app.on_event("startup")
+async def connect_database():
+    global db, cache
+    db = connect_async_db()
+    cache = connect_cache()
+    if db is not None:
+        try:
+            # open the pool before the first request instead of on it
+            await db.command("ping")
+            # lets get_messages walk the index in order instead of sorting in memory;
+            # _id breaks ties between turns stored in the same millisecond
+            await db["message"].create_index([("conversation_id", 1), ("created_at", 1), ("_id", 1)])
+        except PyMongoError as e:
+            # keep serving; /test reports the database error
+            logger.error("MongoDB warm-up failed: %s", e)
+
+
 # --------- Helpers ---------
 class PyObjectId(ObjectId):
     @classmethod
@@ -28,18 +90,83 @@ class PyObjectId(ObjectId):
     def validate(cls, v):
         if isinstance(v, ObjectId):
             return v
-        if not ObjectId.is_valid(v):
+        try:
+            return ObjectId(v)
+        except (InvalidId, TypeError):
             raise ValueError("Invalid ObjectId")
-        return ObjectId(v)
 
-def serialize_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
-    out = {}
-    for k, v in doc.items():
-        if isinstance(v, ObjectId):
-            out[k] = str(v)
-        else:
-            out[k] = v
-    return out
+def parse_object_id(value: str) -> ObjectId:
+    """Parse a path id in a single pass, rejecting malformed ids with a 400"""
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid conversation id")
+
+# $project stage fragment that emits documents keyed "id" (stringified _id), so
+# list endpoints can serialize what MongoDB returns without rebuilding each dict
+_ID_AS_STRING = {"_id": 0, "id": {"$toString": "$_id"}}
+
+def _message_doc(conversation_id: str, role: str, content: str) -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    return {
+        "role": role,
+        "content": content,
+        "conversation_id": conversation_id,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+async def conversation_exists(conversation_id: str, oid: ObjectId) -> bool:
+    """Check a conversation id, consulting the Redis cache before MongoDB"""
+    if cache is not None:
+        try:
+            if await cache.sismember(CONVERSATION_EXISTS_KEY, conversation_id):
+                return True
+            if await cache.exists(conversation_missing_key(conversation_id)):
+                return False
+        except RedisError as e:
+            logger.warning("Redis unavailable, checking MongoDB: %s", e)
+
+    conv = await db["conversation"].find_one({"_id": oid}, {"_id": 1})
+
+    if cache is not None:
+        try:
+            if conv:
+                await cache.sadd(CONVERSATION_EXISTS_KEY, conversation_id)
+            else:
+                await cache.set(conversation_missing_key(conversation_id), 1, ex=CONVERSATION_MISSING_TTL)
+        except RedisError as e:
+            logger.warning("Redis unavailable, skipping cache update: %s", e)
+    return conv is not None
+
+async def bump_messages_version(conversation_id: str) -> None:
+    """Invalidate cached message history for a conversation"""
+    if cache is not None:
+        try:
+            await cache.incr(messages_version_key(conversation_id))
+        except RedisError as e:
+            # cached history may be served stale until MESSAGES_TTL expires
+            logger.warning("Redis unavailable, could not invalidate messages: %s", e)
+
+async def store_messages(key: Optional[str], payload: bytes) -> None:
+    """Cache a serialized message history under its versioned key"""
+    if cache is None or key is None:
+        return
+    try:
+        await cache.setex(key, MESSAGES_TTL, payload)
+    except RedisError as e:
+        logger.warning("Redis unavailable, skipping cache update: %s", e)
+
+async def _insert_message(conversation_id: str, role: str, content: str) -> Dict[str, Any]:
+    """Store one message from primitives and return its public representation"""
+    result = await db["message"].insert_one(_message_doc(conversation_id, role, content))
+    await bump_messages_version(conversation_id)
+    return {
+        "id": str(result.inserted_id),
+        "conversation_id": conversation_id,
+        "role": role,
+        "content": content,
+    }
 
 
 # --------- Schemas ---------
@@ -53,7 +180,7 @@ class ConversationOut(BaseModel):
     created_by: Optional[str] = None
 
 class MessageCreate(BaseModel):
-    role: str = Field(..., pattern="^(user|assistant)$")
+    role: Literal["user", "assistant"]
     content: str
 
 class SendMessageRequest(BaseModel):
@@ -78,116 +205,197 @@ def hello():
 
 # --------- Conversation routes ---------
 @app.post("/api/conversations", response_model=ConversationOut)
-def create_conversation(payload: ConversationCreate):
+async def create_conversation(payload: ConversationCreate):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not available")
     data = payload.model_dump()
-    inserted_id = create_document("conversation", data)
+    inserted_id = await create_document_async("conversation", data)
+    if cache is not None:
+        try:
+            await cache.sadd(CONVERSATION_EXISTS_KEY, inserted_id)
+        except RedisError as e:
+            logger.warning("Redis unavailable, skipping cache update: %s", e)
     return {"id": inserted_id, **data}
 
 @app.get("/api/conversations", response_model=List[ConversationOut])
-def list_conversations():
+async def list_conversations():
     if db is None:
         raise HTTPException(status_code=500, detail="Database not available")
-    docs = get_documents("conversation", {}, limit=100)
-    out = []
-    for d in docs:
-        d = serialize_doc(d)
-        out.append({"id": d.get("_id"), "title": d.get("title"), "created_by": d.get("created_by")})
-    # newest first
-    out.sort(key=lambda x: x["id"], reverse=True)
-    return out
+    # newest first, sorted by MongoDB on the _id index and already in response shape
+    pipeline = [
+        {"$sort": {"_id": -1}},
+        {"$limit": 100},
+        {"$project": {**_ID_AS_STRING, "title": 1, "created_by": {"$ifNull": ["$created_by", None]}}},
+    ]
+    docs = await db["conversation"].aggregate(pipeline).to_list(length=100)
+    return ORJSONResponse(docs)
 
 
 # --------- Message routes ---------
 @app.get("/api/conversations/{conversation_id}/messages", response_model=List[MessageOut])
-def get_messages(conversation_id: str):
+async def get_messages(conversation_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not available")
-    if not ObjectId.is_valid(conversation_id):
-        raise HTTPException(status_code=400, detail="Invalid conversation id")
-    docs = db["message"].find({"conversation_id": conversation_id}).sort("created_at", 1)
-    out: List[MessageOut] = []
-    for d in docs:
-        d = serialize_doc(d)
-        out.append(
-            {
-                "id": d.get("_id"),
-                "conversation_id": d.get("conversation_id"),
-                "role": d.get("role"),
-                "content": d.get("content"),
-            }
-        )
-    return out
+    parse_object_id(conversation_id)
+
+    key = None
+    if cache is not None:
+        try:
+            version = await cache.get(messages_version_key(conversation_id))
+            key = messages_key(conversation_id, version.decode() if version else "0")
+            cached = await cache.get(key)
+        except RedisError as e:
+            logger.warning("Redis unavailable, reading messages from MongoDB: %s", e)
+            key = cached = None
+        if cached is not None:
+            return Response(content=cached, media_type="application/json")
+
+    pipeline = [
+        {"$match": {"conversation_id": conversation_id}},
+        {"$sort": {"created_at": 1, "_id": 1}},
+        {"$project": {**_ID_AS_STRING, "conversation_id": 1, "role": 1, "content": 1}},
+    ]
+    cursor = db["message"].aggregate(pipeline, batchSize=200)
+
+    # Run the query before any response is started, so database errors still map to 500
+    try:
+        first = await cursor.next()
+    except StopAsyncIteration:
+        # not cached: the id may not name a conversation at all
+        return Response(content=b"[]", media_type="application/json")
+
+    async def chunks():
+        # write the JSON array one message at a time as cursor batches arrive
+        yield b"[" + orjson.dumps(first)
+        async for d in cursor:
+            yield b"," + orjson.dumps(d)
+        yield b"]"
+
+    # Keep a copy for the cache only while it stays under MESSAGES_CACHE_MAX_BYTES
+    parts = [] if key is not None else None
+    complete = False
+
+    async def stream():
+        nonlocal parts, complete
+        size = 0
+        async for chunk in chunks():
+            if parts is not None:
+                size += len(chunk)
+                if size > MESSAGES_CACHE_MAX_BYTES:
+                    parts = None
+                else:
+                    parts.append(chunk)
+            yield chunk
+        complete = True
+
+    async def store():
+        # runs after the response is sent, so Redis can't break or delay it
+        if complete and parts is not None:
+            await store_messages(key, b"".join(parts))
+
+    return StreamingResponse(stream(), media_type="application/json", background=BackgroundTask(store))
 
 @app.post("/api/conversations/{conversation_id}/messages", response_model=MessageOut)
-def add_message(conversation_id: str, payload: MessageCreate):
+async def add_message(conversation_id: str, payload: MessageCreate):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not available")
-    if not ObjectId.is_valid(conversation_id):
-        raise HTTPException(status_code=400, detail="Invalid conversation id")
+    oid = parse_object_id(conversation_id)
 
     # Ensure conversation exists
-    conv = db["conversation"].find_one({"_id": ObjectId(conversation_id)})
-    if not conv:
+    if not await conversation_exists(conversation_id, oid):
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    msg_data = payload.model_dump()
-    msg_data["conversation_id"] = conversation_id
-    inserted_id = create_document("message", msg_data)
-
-    return {
-        "id": inserted_id,
-        "conversation_id": conversation_id,
-        "role": payload.role,
-        "content": payload.content,
-    }
+    return await _insert_message(conversation_id, payload.role, payload.content)
 
 
 # --------- Chat endpoint that generates assistant reply ---------
 @app.post("/api/conversations/{conversation_id}/send", response_model=MessageOut)
-def send_message(conversation_id: str, req: SendMessageRequest):
+async def send_message(conversation_id: str, req: SendMessageRequest):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not available")
-    if not ObjectId.is_valid(conversation_id):
-        raise HTTPException(status_code=400, detail="Invalid conversation id")
+    oid = parse_object_id(conversation_id)
 
-    # store user message
-    user_msg = MessageCreate(role="user", content=req.content)
-    _ = add_message(conversation_id, user_msg)
+    # Ensure conversation exists (single lookup for both messages)
+    if not await conversation_exists(conversation_id, oid):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    user_doc = _message_doc(conversation_id, "user", req.content)
 
     # generate assistant reply (simple built-in bot)
     reply_text = generate_ai_reply(req.content)
+    assistant_doc = _message_doc(conversation_id, "assistant", reply_text)
 
-    assistant_msg = MessageCreate(role="assistant", content=reply_text)
-    created = add_message(conversation_id, assistant_msg)
-    return created
+    # store both turns in one round-trip, user message first
+    result = await db["message"].insert_many([user_doc, assistant_doc], ordered=True)
+    await bump_messages_version(conversation_id)
+    return {
+        "id": str(result.inserted_ids[1]),
+        "conversation_id": conversation_id,
+        "role": "assistant",
+        "content": reply_text,
+    }
 
 
 # --------- Simple AI reply generator (no external API) ---------
+_KEYWORD_RE = re.compile(r"(?P<greet>hello|hi|hey)|(?P<help>help)")
+
+
+def _summarize_command(prompt: str) -> str:
+    text = prompt[len("/summarize"):].strip()
+    return f"Summary: {summarize(text)}"
+
+
+def _todo_command(prompt: str) -> str:
+    items = [i.strip() for i in prompt.split(" ")[1:]]
+    bullets = "\n".join(f"• {i}" for i in items if i)
+    return f"Here’s your checklist:\n{bullets}" if bullets else "Provide items after /todo"
+
+
+# Slash commands, keyed by their first token (/help is caught by the keyword scan)
+_COMMANDS = {
+    "/summarize": _summarize_command,
+    "/todo": _todo_command,
+}
+
+
+# Replies are pure functions of the prompt, so short prompts (greetings, commands)
+# are memoized; longer ones rarely repeat and would pin their text in the cache
+REPLY_CACHE_MAX_PROMPT = 256
+
+
 def generate_ai_reply(prompt: str) -> str:
+    if prompt and len(prompt) > REPLY_CACHE_MAX_PROMPT:
+        return _build_ai_reply(prompt)
+    return _cached_ai_reply(prompt)
+
+
+def _build_ai_reply(prompt: str) -> str:
     prompt = (prompt or "").strip()
     if not prompt:
         return "I'm here! Ask me anything."
 
-    # Simple heuristics
+    # Simple heuristics: one scan tags greetings and help requests,
+    # greetings win regardless of where they appear
     lower = prompt.lower()
-    if any(g in lower for g in ["hello", "hi", "hey"]):
-        return "Hey there! How can I help you today?"
-    if lower.startswith("/help") or "help" in lower:
+    wants_help = False
+    for match in _KEYWORD_RE.finditer(lower):
+        if match.lastgroup == "greet":
+            return "Hey there! How can I help you today?"
+        wants_help = True
+    if wants_help:
         return "I can answer questions, summarize, or brainstorm ideas. Just type your message!"
-    if lower.startswith("/summarize"):
-        text = prompt[len("/summarize"):].strip()
-        return f"Summary: {summarize(text)}"
-    if lower.startswith("/todo"):
-        items = [i.strip() for i in prompt.split(" ")[1:]]
-        bullets = "\n".join(f"• {i}" for i in items if i)
-        return f"Here’s your checklist:\n{bullets}" if bullets else "Provide items after /todo"
+    if lower[:1] == "/":
+        command = _COMMANDS.get(lower.split(maxsplit=1)[0])
+        if command is not None:
+            return command(prompt)
 
     # default: reflective response
     return f"You said: '{prompt}'. Here's a helpful thought: {reflect(prompt)}"
 
 
+_cached_ai_reply = lru_cache(maxsize=2048)(_build_ai_reply)
+
+
 def summarize(text: str) -> str:
     # very light 'summary'
     words = text.split()
@@ -197,16 +405,22 @@ def summarize(text: str) -> str:
 
 
 def reflect(text: str) -> str:
-    # simple reflection by extracting key words
-    words = [w.strip('.,!?') for w in text.split()]
-    key = ", ".join(sorted(set([w for w in words if len(w) > 5]))[:6])
+    # simple reflection by extracting key words: dedupe while filtering,
+    # then pick the first six alphabetically without sorting them all
+    long_words = {w for w in (t.strip('.,!?') for t in text.split()) if len(w) > 5}
+    key = ", ".join(heapq.nsmallest(6, long_words))
     if key:
         return f"key points → {key}"
     return "sounds interesting!"
 
 
+# /test doubles as a health probe; list collections at most every COLLECTIONS_TTL seconds
+COLLECTIONS_TTL = 30
+_COLLECTIONS_CACHE: Dict[str, Any] = {"t": float("-inf"), "v": []}
+
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -223,8 +437,10 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
-                response["collections"] = collections[:10]
+                if time.monotonic() - _COLLECTIONS_CACHE["t"] > COLLECTIONS_TTL:
+                    _COLLECTIONS_CACHE["v"] = (await db.list_collection_names())[:10]
+                    _COLLECTIONS_CACHE["t"] = time.monotonic()
+                response["collections"] = _COLLECTIONS_CACHE["v"]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
                 response["database"] = f"⚠️  Connected but Error: {str(e)[:50]}"
@@ -240,7 +456,20 @@ def test_database():
     return response
 
 
+MAX_DEFAULT_WORKERS = 8
+
+
 if __name__ == "__main__":
     import uvicorn
+    if not cors_origins:
+        # logged here, once, rather than in every worker
+        logger.warning(
+            "CORS_ORIGINS is not set: allowing any origin without credentials; "
+            "set it to a comma-separated list of origins to allow cookies cross-origin"
+        )
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # os.cpu_count() reports host cores inside containers, and each worker holds its
+    # own MongoDB pool, so the default is capped; set WEB_CONCURRENCY to go higher
+    workers = int(os.getenv("WEB_CONCURRENCY", min((os.cpu_count() or 1) * 2 + 1, MAX_DEFAULT_WORKERS)))
+    # uvicorn's "auto" loop/http pick uvloop and httptools when they are installed
+    uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers)